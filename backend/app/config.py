@@ -14,6 +14,7 @@ class Settings(BaseSettings):
     
     # App settings
     debug: bool = True
+    thread_pool_size: int = 100
     
     class Config:
         env_file = ".env"
@@ -1,25 +1,43 @@
 """Database connection and session management."""
-from sqlalchemy import create_engine
+import logging
+import orjson
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import get_settings
 
+logger = logging.getLogger(__name__)
+
 settings = get_settings()
 
 # Create database engine with appropriate settings for SQLite vs PostgreSQL
 connect_args = {}
+engine_kwargs = {}
 if settings.database_url.startswith("sqlite"):
     connect_args["check_same_thread"] = False
+else:
+    # Generous pool for threadpool-dispatched requests; recycle before
+    # server-side idle timeouts and ping since network connections can drop
+    engine_kwargs.update(
+        pool_size=20,
+        max_overflow=40,
+        pool_recycle=1800,
+        pool_pre_ping=True
+    )
 
 engine = create_engine(
     settings.database_url,
-    pool_pre_ping=True,
     echo=settings.debug,
-    connect_args=connect_args
+    connect_args=connect_args,
+    # JSON columns (quiz_data, key_entities, ...) go through orjson
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
+    **engine_kwargs
 )
 
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay readable after commit without a refresh round-trip
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Create base class for models
 Base = declarative_base()
@@ -37,3 +55,49 @@ def get_db():
 def init_db():
     """Initialize database tables."""
     Base.metadata.create_all(bind=engine)
+    _upgrade_schema()
+
+
+def _upgrade_schema():
+    """Bring existing tables in line with the current model (columns and indexes)."""
+    columns = {column["name"] for column in inspect(engine).get_columns("quizzes")}
+    
+    with engine.begin() as conn:
+        if "question_count" not in columns:
+            conn.execute(text("ALTER TABLE quizzes ADD COLUMN question_count INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(text("UPDATE quizzes SET question_count = COALESCE(json_array_length(quiz_data), 0)"))
+        
+        if "url_hash" not in columns:
+            from .models import hash_url, normalize_url
+            
+            conn.execute(text("ALTER TABLE quizzes ADD COLUMN url_hash BIGINT"))
+            # Hash the normalized URL, as /generate does, so legacy rows stored
+            # with a fragment or upper-case host are still found. Rows that
+            # normalize to the same URL keep only the oldest quiz.
+            rows = conn.execute(text("SELECT id, url FROM quizzes ORDER BY created_at, id")).all()
+            hashes = {}
+            duplicates = []
+            for row in rows:
+                url_hash = hash_url(normalize_url(row.url))
+                if url_hash in hashes:
+                    duplicates.append({"id": row.id})
+                    logger.warning(f"Removing duplicate quiz {row.id} ({row.url}), keeping quiz {hashes[url_hash]}")
+                else:
+                    hashes[url_hash] = row.id
+            if duplicates:
+                conn.execute(text("DELETE FROM quizzes WHERE id = :id"), duplicates)
+            if hashes:
+                conn.execute(
+                    text("UPDATE quizzes SET url_hash = :url_hash WHERE id = :id"),
+                    [{"id": row_id, "url_hash": url_hash} for url_hash, row_id in hashes.items()]
+                )
+            conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_quizzes_url_hash ON quizzes (url_hash)"))
+            # Uniqueness now lives on url_hash; the wide URL index is dead weight
+            conn.execute(text("DROP INDEX IF EXISTS ix_quizzes_url"))
+        
+        if "raw_html" in columns:
+            # Scraped HTML was never served and dominated row size
+            conn.execute(text("ALTER TABLE quizzes DROP COLUMN raw_html"))
+        
+        # History is ordered by created_at; a plain btree serves DESC scans too
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_quizzes_created_at ON quizzes (created_at)"))
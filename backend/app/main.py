@@ -1,11 +1,15 @@
 """FastAPI main application entry point."""
 import os
+from contextlib import asynccontextmanager
+import anyio.to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 
+from .config import get_settings
 from .database import init_db
 from .routers import quiz
+from .services.llm_service import create_llm, load_encoding
 
 # Configure logging
 logging.basicConfig(
@@ -14,13 +18,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up shared resources on startup."""
+    # Sync route handlers run in AnyIO's worker threads; raise the default
+    # limit of 40 so slow scrape/LLM requests don't starve the pool
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = get_settings().thread_pool_size
+    
+    # One LLM client for the app's lifetime, handed to routes via get_llm.
+    # A bad configuration only disables quiz generation, not the whole API.
+    try:
+        app.state.llm = create_llm()
+    except Exception as e:
+        logger.error(f"Failed to initialize LLM client: {str(e)}")
+        app.state.llm = None
+    
+    # Fetch the tokenizer now rather than inside the first /generate request
+    await anyio.to_thread.run_sync(load_encoding)
+    
+    logger.info("Initializing database...")
+    init_db()
+    logger.info("Database initialized successfully")
+    yield
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Wiki Quiz API",
     description="Generate quizzes from Wikipedia articles using AI",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Configure CORS - allow Vercel and local development
@@ -49,14 +80,6 @@ app.add_middleware(
 app.include_router(quiz.router)
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database on startup."""
-    logger.info("Initializing database...")
-    init_db()
-    logger.info("Database initialized successfully")
-
-
 @app.get("/", tags=["health"])
 async def root():
     """Health check endpoint."""
@@ -1,24 +1,43 @@
 """SQLAlchemy database models."""
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+from sqlalchemy import BigInteger, Column, Integer, String, Text, DateTime, JSON
 from sqlalchemy.sql import func
 from .database import Base
 
 
+def hash_url(url: str) -> int:
+    """Signed 64-bit hash of a URL, used as the compact lookup key for quizzes."""
+    digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of an article URL: trimmed, lower-case scheme and host, no fragment."""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        # e.g. an unbalanced IPv6 bracket in the host
+        raise ValueError(f"Invalid Wikipedia URL: {url}")
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+
+
 class Quiz(Base):
     """Quiz model for storing generated quizzes from Wikipedia articles."""
     
     __tablename__ = "quizzes"
     
     id = Column(Integer, primary_key=True, index=True)
-    url = Column(String(2048), nullable=False, unique=True, index=True)
+    url = Column(String(2048), nullable=False)
+    url_hash = Column(BigInteger, nullable=False, unique=True, index=True)  # hash_url(url); lookups and uniqueness go through this
     title = Column(String(500), nullable=False)
     summary = Column(Text, nullable=True)
     key_entities = Column(JSON, nullable=True)  # {"people": [], "organizations": [], "locations": []}
     sections = Column(JSON, nullable=True)  # ["Section 1", "Section 2", ...]
     quiz_data = Column(JSON, nullable=False)  # List of quiz questions
+    question_count = Column(Integer, nullable=False, default=0)  # len(quiz_data), kept for history listings
     related_topics = Column(JSON, nullable=True)  # List of related topic strings
-    raw_html = Column(Text, nullable=True)  # Store raw HTML for reference
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     def __repr__(self):
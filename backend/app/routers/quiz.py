@@ -1,31 +1,79 @@
 """Quiz API router with endpoints for quiz generation and history."""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy import delete, select, func
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
-from typing import List
+from sqlalchemy.dialects import postgresql, sqlite
+from langchain_groq import ChatGroq
+from cachetools import LRUCache, TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import List, NamedTuple, Optional
+import hashlib
 import logging
+import orjson
 import traceback
 
-from ..database import get_db
-from ..models import Quiz
+from ..config import get_settings
+from ..database import SessionLocal, get_db
+from ..models import Quiz, hash_url, normalize_url
 from ..schemas import (
     QuizGenerateRequest,
     QuizResponse,
-    QuizListItem,
     QuizHistoryResponse,
     KeyEntities,
     QuizQuestion
 )
 from ..services.scraper import scrape_wikipedia
-from ..services.llm_service import generate_quiz, generate_related_topics
+from ..services.llm_service import generate_quiz, generate_related_topics, get_llm
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/quiz", tags=["quiz"])
 
+# Quizzes can be deleted and their IDs reused, so caches must revalidate
+# every read; a matching ETag keeps that to a cheap 304
+QUIZ_CACHE_CONTROL = "no-cache"
+
+
+class _QuizJSON(NamedTuple):
+    """Serialized QuizResponse together with the row version it was built from."""
+    version: Optional[datetime]
+    etag: str
+    body: bytes
+
+
+# Serialized QuizResponse bodies keyed by quiz ID. Each entry is tagged with
+# the row's last modification time so an updated quiz is re-serialized.
+RESPONSE_CACHE_SIZE = 512
+_response_cache: "LRUCache[int, _QuizJSON]" = LRUCache(maxsize=RESPONSE_CACHE_SIZE)
+_response_cache_lock = Lock()
+
+# Recently requested quizzes keyed by URL hash, so repeat /generate calls
+# for the same article are answered without touching the database
+URL_CACHE_SIZE = 1024
+URL_CACHE_TTL = 3600
+_url_cache: "TTLCache[int, _QuizJSON]" = TTLCache(maxsize=URL_CACHE_SIZE, ttl=URL_CACHE_TTL)
+_url_cache_lock = Lock()
+
+# Dialect-specific INSERT constructs supporting ON CONFLICT DO NOTHING
+_UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# Runs the related-topics LLM call alongside quiz generation
+_llm_executor = ThreadPoolExecutor(
+    max_workers=get_settings().thread_pool_size,
+    thread_name_prefix="llm"
+)
+
 
 @router.post("/generate", response_model=QuizResponse, status_code=status.HTTP_201_CREATED)
-async def generate_quiz_endpoint(request: QuizGenerateRequest, db: Session = Depends(get_db)):
+def generate_quiz_endpoint(
+    request: QuizGenerateRequest,
+    llm: ChatGroq = Depends(get_llm)
+):
     """
     Generate a quiz from a Wikipedia article URL.
     
@@ -33,85 +81,85 @@ async def generate_quiz_endpoint(request: QuizGenerateRequest, db: Session = Dep
     - Uses LLM to generate quiz questions
     - Stores the result in the database
     - Returns the full quiz data
-    """
-    url = request.url.strip()
-    
-    # Check if quiz already exists for this URL (caching)
-    existing_quiz = db.query(Quiz).filter(Quiz.url == url).first()
-    if existing_quiz:
-        logger.info(f"Returning cached quiz for URL: {url}")
-        return _quiz_to_response(existing_quiz)
     
+    Database sessions are opened only around the cache check and the
+    insert, so no connection is held during scraping or LLM calls.
+    """
     try:
+        url = normalize_url(request.url)
+        
+        # Check if quiz already exists for this URL (caching)
+        existing = _check_cached(url)
+        if existing is not None:
+            logger.info(f"Returning cached quiz for URL: {url}")
+            return _json_response(existing.body, status.HTTP_201_CREATED, {"ETag": existing.etag})
+        
         # Step 1: Scrape the Wikipedia article
         logger.info(f"Scraping Wikipedia article: {url}")
         scraped_data = scrape_wikipedia(url)
-        logger.info(f"Scraped article: {scraped_data['title']}, content length: {len(scraped_data['content'])}")
+        logger.info(f"Scraped article: {scraped_data.title}, content length: {len(scraped_data.content)}")
         
-        # Step 2: Generate quiz using LLM
-        logger.info(f"Generating quiz for: {scraped_data['title']}")
-        quiz_questions = generate_quiz(
-            title=scraped_data["title"],
-            content=scraped_data["content"],
-            num_questions=7
+        # Step 2: Generate related topics in the background - it only
+        # needs the scraped data, not the quiz
+        logger.info("Generating related topics")
+        topics_future = _llm_executor.submit(
+            generate_related_topics,
+            title=scraped_data.title,
+            sections=scraped_data.sections,
+            entities=scraped_data.key_entities,
+            llm=llm
         )
+        
+        # Step 3: Generate quiz using LLM
+        logger.info(f"Generating quiz for: {scraped_data.title}")
+        try:
+            quiz_questions = generate_quiz(
+                title=scraped_data.title,
+                content=scraped_data.content,
+                num_questions=7,
+                llm=llm
+            )
+        except Exception:
+            topics_future.cancel()
+            raise
         logger.info(f"Generated {len(quiz_questions)} questions")
         
         if not quiz_questions:
+            topics_future.cancel()
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to generate quiz questions. Please try again."
             )
         
-        # Step 3: Generate related topics
-        logger.info("Generating related topics")
-        related_topics = generate_related_topics(
-            title=scraped_data["title"],
-            sections=scraped_data["sections"],
-            entities=scraped_data["key_entities"]
-        )
+        related_topics = topics_future.result()
         logger.info(f"Generated {len(related_topics)} related topics")
         
         # Step 4: Store in database
         logger.info("Storing quiz in database")
-        quiz = Quiz(
+        created = _persist_quiz(
             url=url,
-            title=scraped_data["title"],
-            summary=scraped_data["summary"],
-            key_entities=scraped_data["key_entities"],
-            sections=scraped_data["sections"],
+            url_hash=hash_url(url),
+            title=scraped_data.title,
+            summary=scraped_data.summary,
+            key_entities=scraped_data.key_entities,
+            sections=scraped_data.sections,
             quiz_data=quiz_questions,
-            related_topics=related_topics,
-            raw_html=scraped_data["raw_html"]
+            question_count=len(quiz_questions),
+            related_topics=related_topics
         )
+        return _json_response(created.body, status.HTTP_201_CREATED, {"ETag": created.etag})
         
-        db.add(quiz)
-        db.commit()
-        db.refresh(quiz)
-        
-        logger.info(f"Quiz created with ID: {quiz.id}")
-        return _quiz_to_response(quiz)
-        
+    except HTTPException:
+        raise
     except ValueError as e:
         logger.error(f"Validation error: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
-    except IntegrityError:
-        db.rollback()
-        # Race condition - quiz was created by another request
-        existing_quiz = db.query(Quiz).filter(Quiz.url == url).first()
-        if existing_quiz:
-            return _quiz_to_response(existing_quiz)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Database error. Please try again."
-        )
     except Exception as e:
         logger.error(f"Error generating quiz: {str(e)}")
         logger.error(f"Full traceback: {traceback.format_exc()}")
-        db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate quiz: {str(e)}"
@@ -119,7 +167,7 @@ async def generate_quiz_endpoint(request: QuizGenerateRequest, db: Session = Dep
 
 
 @router.get("/history", response_model=QuizHistoryResponse)
-async def get_quiz_history(
+def get_quiz_history(
     skip: int = 0,
     limit: int = 50,
     db: Session = Depends(get_db)
@@ -130,60 +178,221 @@ async def get_quiz_history(
     - Returns paginated list of quizzes
     - Ordered by creation date (newest first)
     """
-    # Get total count
-    total = db.query(Quiz).count()
+    # Fetch the page and the total count in one round-trip; only the
+    # columns the list needs are selected, never the JSON blobs
+    stmt = (
+        select(
+            Quiz.id,
+            Quiz.url,
+            Quiz.title,
+            Quiz.question_count,
+            Quiz.created_at,
+            func.count().over().label("total")
+        )
+        .order_by(Quiz.created_at.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    rows = db.execute(stmt).all()
     
-    # Get quizzes with pagination
-    quizzes = db.query(Quiz).order_by(Quiz.created_at.desc()).offset(skip).limit(limit).all()
+    if rows:
+        total = rows[0].total
+    elif skip > 0:
+        # Page past the end - the window count has no row to ride on
+        total = db.scalar(select(func.count(Quiz.id)))
+    else:
+        total = 0
     
+    # Serialize the rows directly; the QuizHistoryResponse model only
+    # documents the shape for OpenAPI
     quiz_items = [
-        QuizListItem(
-            id=q.id,
-            url=q.url,
-            title=q.title,
-            question_count=len(q.quiz_data) if q.quiz_data else 0,
-            created_at=q.created_at
-        )
-        for q in quizzes
+        {
+            "id": row.id,
+            "url": row.url,
+            "title": row.title,
+            "question_count": row.question_count,
+            "created_at": row.created_at
+        }
+        for row in rows
     ]
     
-    return QuizHistoryResponse(quizzes=quiz_items, total=total)
+    return _json_response(orjson.dumps({"quizzes": quiz_items, "total": total}))
 
 
 @router.get("/{quiz_id}", response_model=QuizResponse)
-async def get_quiz_details(quiz_id: int, db: Session = Depends(get_db)):
+def get_quiz_details(quiz_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Get details of a specific quiz by ID.
+    
+    Responses carry an ETag; a matching If-None-Match gets 304 Not Modified.
     """
-    quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
+    cached = _load_quiz_json(db, Quiz.id == quiz_id)
     
-    if not quiz:
+    if cached is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Quiz with ID {quiz_id} not found"
         )
     
-    return _quiz_to_response(quiz)
+    return _quiz_json_response(cached, request)
 
 
 @router.delete("/{quiz_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_quiz(quiz_id: int, db: Session = Depends(get_db)):
+def delete_quiz(quiz_id: int, db: Session = Depends(get_db)):
     """
     Delete a quiz by ID.
     """
-    quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
+    url_hash = db.scalar(delete(Quiz).where(Quiz.id == quiz_id).returning(Quiz.url_hash))
+    db.commit()
     
-    if not quiz:
+    if url_hash is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Quiz with ID {quiz_id} not found"
         )
     
-    db.delete(quiz)
+    _invalidate_cached_quiz(quiz_id, url_hash)
+    return None
+
+
+def _check_cached(url: str) -> Optional[_QuizJSON]:
+    """Return the serialized quiz already stored for a URL, if any."""
+    url_hash = hash_url(url)
+    with _url_cache_lock:
+        cached = _url_cache.get(url_hash)
+    if cached is not None:
+        return cached
+    
+    with SessionLocal() as db:
+        cached = _load_quiz_json(db, Quiz.url_hash == url_hash)
+    if cached is not None:
+        with _url_cache_lock:
+            _url_cache[url_hash] = cached
+    return cached
+
+
+def _persist_quiz(**values) -> _QuizJSON:
+    """Store a newly generated quiz and return its serialized response."""
+    with SessionLocal() as db:
+        quiz = _insert_quiz(db, **values)
+        
+        if quiz is None:
+            # Race condition - quiz was created by another request
+            existing = _load_quiz_json(db, Quiz.url_hash == values["url_hash"])
+            if existing is not None:
+                return existing
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Database error. Please try again."
+            )
+        
+        logger.info(f"Quiz created with ID: {quiz.id}")
+        _invalidate_cached_quiz(quiz.id)
+        cached = _cached_quiz_json(quiz)
+    
+    with _url_cache_lock:
+        _url_cache[quiz.url_hash] = cached
+    return cached
+
+
+def _insert_quiz(db: Session, **values) -> Optional[Quiz]:
+    """
+    Insert a quiz in a single round-trip, returning the new row.
+    
+    Returns None if a quiz for the same URL already exists.
+    """
+    insert = _UPSERT_INSERTS[db.get_bind().dialect.name]
+    stmt = (
+        insert(Quiz)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=[Quiz.url_hash])
+        .returning(Quiz)
+    )
+    quiz = db.scalars(stmt).first()
     db.commit()
+    return quiz
+
+
+def _json_response(body: bytes, status_code: int = status.HTTP_200_OK, headers: Optional[dict] = None) -> Response:
+    """Wrap pre-serialized JSON in a response, bypassing response_model encoding."""
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def _quiz_json_response(cached: _QuizJSON, request: Request) -> Response:
+    """
+    Build a revalidatable response for a stored quiz.
+    
+    A matching If-None-Match yields 304 Not Modified.
+    """
+    headers = {"ETag": cached.etag, "Cache-Control": QUIZ_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if cached.etag in client_etags or "*" in client_etags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return _json_response(cached.body, headers=headers)
+
+
+def _quiz_etag(body: bytes) -> str:
+    """Strong ETag for a serialized quiz response."""
+    # Hash the body itself: IDs can be reused after a delete and timestamps
+    # only have one-second resolution, so neither identifies a quiz version
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def _load_quiz_json(db: Session, *criteria) -> Optional[_QuizJSON]:
+    """
+    Return the serialized QuizResponse for the quiz matching criteria.
+    
+    Only the ID and timestamps are selected up front; the full row is
+    loaded only when no current response body is cached.
+    """
+    row = db.execute(
+        select(Quiz.id, Quiz.created_at, Quiz.updated_at).where(*criteria)
+    ).first()
+    if row is None:
+        return None
+    
+    cached = _lookup_quiz_json(row.id, row.updated_at or row.created_at)
+    if cached is not None:
+        return cached
+    
+    quiz = db.get(Quiz, row.id)
+    return _cached_quiz_json(quiz) if quiz else None
+
+
+def _lookup_quiz_json(quiz_id: int, version: Optional[datetime]) -> Optional[_QuizJSON]:
+    """Return the cached response for a quiz if it matches version."""
+    with _response_cache_lock:
+        cached = _response_cache.get(quiz_id)
+    if cached is not None and cached.version == version:
+        return cached
     return None
 
 
+def _cached_quiz_json(quiz: Quiz) -> _QuizJSON:
+    """Return the serialized QuizResponse for a quiz, reusing the cached bytes if current."""
+    version = quiz.updated_at or quiz.created_at
+    cached = _lookup_quiz_json(quiz.id, version)
+    if cached is not None:
+        return cached
+    
+    body = _quiz_to_response(quiz).model_dump_json().encode()
+    cached = _QuizJSON(version=version, etag=_quiz_etag(body), body=body)
+    with _response_cache_lock:
+        _response_cache[quiz.id] = cached
+    return cached
+
+
+def _invalidate_cached_quiz(quiz_id: int, url_hash: Optional[int] = None) -> None:
+    """Drop any cached response body for a quiz."""
+    with _response_cache_lock:
+        _response_cache.pop(quiz_id, None)
+    if url_hash is not None:
+        with _url_cache_lock:
+            _url_cache.pop(url_hash, None)
+
+
 def _quiz_to_response(quiz: Quiz) -> QuizResponse:
     """Convert Quiz model to QuizResponse schema."""
     key_entities = None
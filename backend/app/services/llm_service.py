@@ -1,8 +1,14 @@
 """LLM service for quiz generation using LangChain and Groq."""
-import json
 import re
+import hashlib
+import orjson
 import logging
-from typing import Dict, List, Optional
+import msgspec
+import tiktoken
+from cachetools import LRUCache
+from threading import Lock
+from typing import Dict, List, Optional, Tuple, Type
+from fastapi import HTTPException, Request, status
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
@@ -10,22 +16,33 @@ from ..config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# Token budget for article content in the quiz prompt
+MAX_CONTENT_TOKENS = 3000
+# Character budget for MAX_CONTENT_TOKENS when the tokenizer can't be loaded;
+# other token budgets are scaled from it
+MAX_CONTENT_CHARS = 10000
 
-# Pydantic models for structured output
-class QuizQuestionModel(BaseModel):
-    """Model for a single quiz question."""
-    question: str = Field(description="The question text")
-    options: List[str] = Field(description="Four possible answers (A, B, C, D)")
-    answer: str = Field(description="The correct answer (must match one of the options)")
-    difficulty: str = Field(description="Difficulty level: easy, medium, or hard")
-    explanation: str = Field(description="Brief explanation referencing the article")
+# Fallback patterns for pulling JSON out of chatty LLM responses
+_CODEBLOCK_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)```")
+_JSON_OBJ_RE = re.compile(r"\{[\s\S]*\}")
+
+
+# msgspec structs for decoding quiz output straight from the JSON reply
+class RawQuestion(msgspec.Struct):
+    """A single quiz question as returned by the LLM."""
+    question: str
+    options: List[str]
+    answer: str
+    difficulty: str
+    explanation: str
 
 
-class QuizOutputModel(BaseModel):
-    """Model for the complete quiz output."""
-    quiz: List[QuizQuestionModel] = Field(description="List of quiz questions")
+class RawQuiz(msgspec.Struct):
+    """The complete quiz output."""
+    quiz: List[RawQuestion]
 
 
+# Pydantic models for structured output
 class RelatedTopicsModel(BaseModel):
     """Model for related topics output."""
     topics: List[str] = Field(description="List of related topic names")
@@ -99,23 +116,103 @@ QUIZ_PROMPT_TEMPLATE = ChatPromptTemplate.from_template(QUIZ_GENERATION_PROMPT)
 RELATED_TOPICS_TEMPLATE = ChatPromptTemplate.from_template(RELATED_TOPICS_PROMPT)
 
 
+_encoding: Optional[tiktoken.Encoding] = None
+_encoding_lock = Lock()
+
+
+def load_encoding() -> Optional[tiktoken.Encoding]:
+    """
+    Load the tokenizer used to measure prompt content.
+    
+    The BPE file is downloaded on first use, so this runs at app startup.
+    Returns None if it can't be fetched; content is then cut by characters
+    and the download is retried on the next call.
+    """
+    global _encoding
+    if _encoding is not None:
+        return _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logger.warning(f"Tokenizer unavailable, truncating content by characters: {str(e)}")
+        return _encoding
+
+
+# Truncated prompt content keyed by (content digest, token budget), so the
+# cache doesn't hold full article bodies as keys
+_truncation_cache: "LRUCache[Tuple[bytes, int], str]" = LRUCache(maxsize=128)
+_truncation_cache_lock = Lock()
+
+
+def _cut_at_paragraph(truncated: str) -> str:
+    """Trim a truncated text back to a paragraph boundary if one is near the end."""
+    last_para = truncated.rfind("\n\n")
+    if last_para > len(truncated) * 0.7:
+        return truncated[:last_para] + "\n\n[Content truncated for length...]"
+    return truncated + "\n\n[Content truncated for length...]"
+
+
+def _truncate_to_tokens(content: str, max_tokens: int) -> str:
+    """Truncate content to max_tokens, memoized per article."""
+    content_hash = hashlib.blake2b(content.encode(), digest_size=16).digest()
+    key = (content_hash, max_tokens)
+    with _truncation_cache_lock:
+        cached = _truncation_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    encoding = load_encoding()
+    if encoding is None:
+        # Not memoized, so the cut is redone by tokens once the tokenizer loads
+        max_chars = max_tokens * MAX_CONTENT_CHARS // MAX_CONTENT_TOKENS
+        return content if len(content) <= max_chars else _cut_at_paragraph(content[:max_chars])
+    
+    tokens = encoding.encode(content, disallowed_special=())
+    truncated = content if len(tokens) <= max_tokens else _cut_at_paragraph(encoding.decode(tokens[:max_tokens]))
+    with _truncation_cache_lock:
+        _truncation_cache[key] = truncated
+    return truncated
+
+
+def create_llm() -> ChatGroq:
+    """Create the Groq chat client from application settings."""
+    settings = get_settings()
+    logger.info("Initializing Groq LLM...")
+    return ChatGroq(
+        api_key=settings.groq_api_key,
+        model_name="llama-3.1-8b-instant",
+        temperature=0.3,
+        max_tokens=4096
+    )
+
+
+def get_llm(request: Request) -> ChatGroq:
+    """Dependency to get the LLM client created during app startup."""
+    llm = request.app.state.llm
+    if llm is None:
+        # Startup couldn't build the client (e.g. missing GROQ_API_KEY)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Quiz generation is unavailable: the LLM client is not configured"
+        )
+    return llm
+
+
 class LLMService:
     """Service for generating quizzes using LLM."""
     
     def __init__(self):
         self._llm = None
+        self._llm_lock = Lock()
     
     def _get_llm(self):
-        """Lazy initialization of LLM client."""
+        """Lazy initialization of LLM client for callers outside the app (e.g. scripts)."""
         if self._llm is None:
-            settings = get_settings()
-            logger.info(f"Initializing Groq LLM...")
-            self._llm = ChatGroq(
-                api_key=settings.groq_api_key,
-                model_name="llama-3.1-8b-instant",
-                temperature=0.3,
-                max_tokens=4096
-            )
+            with self._llm_lock:
+                if self._llm is None:
+                    self._llm = create_llm()
         return self._llm
     
     def _parse_json_response(self, response: str) -> Dict:
@@ -125,44 +222,59 @@ class LLMService:
         
         # Try direct parsing first
         try:
-            return json.loads(text)
-        except json.JSONDecodeError:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
             pass
         
         # Try to find JSON in markdown code blocks
-        json_match = re.search(r"```(?:json)?\s*([\s\S]*?)```", text)
+        json_match = _CODEBLOCK_RE.search(text)
         if json_match:
             try:
-                return json.loads(json_match.group(1).strip())
-            except json.JSONDecodeError:
+                return orjson.loads(json_match.group(1).strip())
+            except orjson.JSONDecodeError:
                 pass
         
         # Try to find JSON object in the text
-        json_match = re.search(r"\{[\s\S]*\}", text)
+        json_match = _JSON_OBJ_RE.search(text)
         if json_match:
             try:
-                return json.loads(json_match.group(0))
-            except json.JSONDecodeError:
+                return orjson.loads(json_match.group(0))
+            except orjson.JSONDecodeError:
                 pass
         
         raise ValueError(f"Could not parse JSON from response: {text[:500]}")
     
-    def _truncate_content(self, content: str, max_chars: int = 10000) -> str:
-        """Truncate content to fit within token limits."""
-        if len(content) <= max_chars:
-            return content
+    def _invoke_structured(self, llm: ChatGroq, messages: List, schema: Type[BaseModel]) -> Dict:
+        """
+        Invoke the LLM in JSON mode and parse the reply into schema.
+        
+        Replies that don't validate against the schema (e.g. one malformed
+        question) fall back to lenient parsing of the raw text.
+        """
+        structured_llm = llm.with_structured_output(schema, method="json_mode", include_raw=True)
+        result = structured_llm.invoke(messages)
+        
+        parsed = result.get("parsed")
+        if parsed is not None:
+            return parsed.model_dump()
         
-        # Try to truncate at a paragraph boundary
-        truncated = content[:max_chars]
-        last_para = truncated.rfind("\n\n")
-        if last_para > max_chars * 0.7:
-            return truncated[:last_para] + "\n\n[Content truncated for length...]"
-        return truncated + "\n\n[Content truncated for length...]"
+        logger.warning(f"Structured output failed to parse: {result.get('parsing_error')}")
+        return self._parse_json_response(result["raw"].content)
     
-    def generate_quiz(self, title: str, content: str, num_questions: int = 7) -> List[Dict]:
+    def _truncate_content(self, content: str, max_tokens: int = MAX_CONTENT_TOKENS) -> str:
+        """Truncate content to fit within token limits."""
+        return _truncate_to_tokens(content, max_tokens)
+    
+    def generate_quiz(
+        self,
+        title: str,
+        content: str,
+        num_questions: int = 7,
+        llm: Optional[ChatGroq] = None
+    ) -> List[Dict]:
         """Generate quiz questions from article content."""
         try:
-            llm = self._get_llm()
+            llm = llm or self._get_llm()
             
             # Truncate content to avoid token limits
             truncated_content = self._truncate_content(content)
@@ -175,28 +287,34 @@ class LLMService:
                 num_questions=num_questions
             )
             
-            # Generate response
+            # Generate response in JSON mode
             logger.info("Calling Groq API for quiz generation...")
-            response = llm.invoke(messages)
+            response = llm.bind(response_format={"type": "json_object"}).invoke(messages)
             logger.info(f"Received response with {len(response.content)} chars")
             
-            # Parse the response
-            parsed = self._parse_json_response(response.content)
+            try:
+                # Decode and type-check the whole reply in one pass
+                raw_quiz = msgspec.json.decode(response.content, type=RawQuiz)
+                quiz = [msgspec.structs.asdict(q) for q in raw_quiz.quiz]
+            except msgspec.DecodeError as e:
+                # Malformed or partially valid output - salvage what we can
+                logger.warning(f"Quiz output failed typed decoding: {e}")
+                parsed = self._parse_json_response(response.content)
+                quiz = [
+                    q for q in parsed.get("quiz", [])
+                    if all(key in q for key in ["question", "options", "answer", "difficulty", "explanation"])
+                ]
             
             # Validate and clean quiz questions
-            quiz = parsed.get("quiz", [])
             valid_questions = []
-            
             for q in quiz:
-                # Ensure all required fields exist
-                if all(key in q for key in ["question", "options", "answer", "difficulty", "explanation"]):
-                    # Validate options count
-                    if len(q["options"]) == 4:
-                        # Normalize difficulty
-                        q["difficulty"] = q["difficulty"].lower()
-                        if q["difficulty"] not in ["easy", "medium", "hard"]:
-                            q["difficulty"] = "medium"
-                        valid_questions.append(q)
+                # Validate options count
+                if len(q["options"]) == 4:
+                    # Normalize difficulty
+                    q["difficulty"] = q["difficulty"].lower()
+                    if q["difficulty"] not in ["easy", "medium", "hard"]:
+                        q["difficulty"] = "medium"
+                    valid_questions.append(q)
             
             logger.info(f"Generated {len(valid_questions)} valid questions")
             return valid_questions
@@ -205,10 +323,16 @@ class LLMService:
             logger.error(f"Error generating quiz: {str(e)}", exc_info=True)
             raise
     
-    def generate_related_topics(self, title: str, sections: List[str], entities: Dict) -> List[str]:
+    def generate_related_topics(
+        self,
+        title: str,
+        sections: List[str],
+        entities: Dict,
+        llm: Optional[ChatGroq] = None
+    ) -> List[str]:
         """Generate related topics for further reading."""
         try:
-            llm = self._get_llm()
+            llm = llm or self._get_llm()
             
             # Create the prompt
             messages = RELATED_TOPICS_TEMPLATE.format_messages(
@@ -219,12 +343,9 @@ class LLMService:
                 locations=", ".join(entities.get("locations", [])[:5]) if entities.get("locations") else "N/A"
             )
             
-            # Generate response
+            # Generate and parse the response
             logger.info("Calling Groq API for related topics...")
-            response = llm.invoke(messages)
-            
-            # Parse the response
-            parsed = self._parse_json_response(response.content)
+            parsed = self._invoke_structured(llm, messages, RelatedTopicsModel)
             
             # Extract topics
             topics = parsed.get("topics", [])
@@ -245,11 +366,21 @@ class LLMService:
 llm_service = LLMService()
 
 
-def generate_quiz(title: str, content: str, num_questions: int = 7) -> List[Dict]:
+def generate_quiz(
+    title: str,
+    content: str,
+    num_questions: int = 7,
+    llm: Optional[ChatGroq] = None
+) -> List[Dict]:
     """Convenience function to generate a quiz."""
-    return llm_service.generate_quiz(title, content, num_questions)
+    return llm_service.generate_quiz(title, content, num_questions, llm=llm)
 
 
-def generate_related_topics(title: str, sections: List[str], entities: Dict) -> List[str]:
+def generate_related_topics(
+    title: str,
+    sections: List[str],
+    entities: Dict,
+    llm: Optional[ChatGroq] = None
+) -> List[str]:
     """Convenience function to generate related topics."""
-    return llm_service.generate_related_topics(title, sections, entities)
+    return llm_service.generate_related_topics(title, sections, entities, llm=llm)
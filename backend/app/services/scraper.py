@@ -1,9 +1,112 @@
-"""Wikipedia scraping service using BeautifulSoup."""
+"""Wikipedia scraping service using lxml."""
+import asyncio
+import copy
+import html
+import logging
+import ahocorasick
 import requests
-from bs4 import BeautifulSoup, Tag
-from typing import Dict, List, Optional, Tuple
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from urllib3.util.retry import Retry
+import lxml.html
+from itertools import islice
+from typing import Dict, FrozenSet, List, Optional, Tuple
 import re
-from urllib.parse import urlparse
+from urllib.parse import unquote, urlsplit
+from ..models import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Patterns used while walking the article, compiled once at import
+_INFOBOX_RE = re.compile(r"infobox")
+_DIGITS_RE = re.compile(r"^\d+$")
+_DATE_RE = re.compile(r"^\w+\s+\d+")
+_TAG_RE = re.compile(r"<[^>]+>")
+
+# Article URLs on any Wikipedia host (en., en.m., ...), excluding non-article namespaces
+_WIKI_URL_RE = re.compile(
+    r"(?i:https?://(?:[a-z0-9-]+\.)*wikipedia\.org(?::\d+)?)/wiki/"
+    r"(?!(?:Special|File|Category|Template|Talk|User|Wikipedia|Help|Portal):)"
+    r"[^?#]+(?:[?#].*)?$"
+)
+
+# Entity keywords matched against link hrefs, per link scope
+_INFOBOX_KEYWORDS = {
+    "organizations": ("university", "institute", "company", "organization", "corporation"),
+    "locations": ("country", "city", "state", "kingdom", "republic"),
+}
+_CONTENT_KEYWORDS = {
+    "organizations": ("_university", "_college", "_institute", "_company", "_corporation"),
+    "locations": ("_country", "_city", "_state", "united_kingdom", "united_states"),
+}
+
+
+def _build_automaton(keywords: Dict[str, Tuple[str, ...]]) -> ahocorasick.Automaton:
+    """Build an Aho-Corasick automaton mapping each keyword to its entity category."""
+    automaton = ahocorasick.Automaton()
+    for category, words in keywords.items():
+        for word in words:
+            automaton.add_word(word, category)
+    automaton.make_automaton()
+    return automaton
+
+
+_INFOBOX_AC = _build_automaton(_INFOBOX_KEYWORDS)
+_CONTENT_AC = _build_automaton(_CONTENT_KEYWORDS)
+
+
+def _match_category(automaton: ahocorasick.Automaton, href: str) -> Optional[str]:
+    """Entity category for an href; organization keywords win over locations."""
+    category = None
+    for _, matched in automaton.iter(href):
+        if matched == "organizations":
+            return matched
+        category = matched
+    return category
+
+
+def _parse_html(markup, fragment: bool = False) -> lxml.html.HtmlElement:
+    """Parse a full page or an HTML fragment, dropping non-visible text."""
+    if fragment:
+        root = lxml.html.fragment_fromstring(markup, create_parent="div")
+    else:
+        root = lxml.html.document_fromstring(markup)
+    # Script and style contents are never part of the article text. Blank them
+    # in place so the text around them stays in separate nodes.
+    for elem in root.iter("script", "style"):
+        elem.text = None
+    return root
+
+
+def _text(elem: lxml.html.HtmlElement) -> str:
+    """Text content of an element, stripped at the ends."""
+    # One libxml2 call, and inner spacing is kept ("Turing was", not "Turingwas")
+    return elem.text_content().strip()
+
+
+def _find_by_class(elem: lxml.html.HtmlElement, tag: str, cls: str) -> Optional[lxml.html.HtmlElement]:
+    """First descendant with the given tag and class token, stopping at the match."""
+    for candidate in elem.iterdescendants(tag):
+        if cls in candidate.get("class", "").split():
+            return candidate
+    return None
+
+
+@dataclass
+class ScrapedArticle:
+    """Structured data extracted from a Wikipedia article."""
+    # Explicit slots keep instances compact (dataclass(slots=True) needs 3.10)
+    __slots__ = ("url", "title", "summary", "sections", "content", "key_entities", "raw_html")
+    url: str
+    title: str
+    summary: str
+    sections: List[str]
+    content: str
+    key_entities: Dict[str, List[str]]
+    raw_html: Optional[str]
 
 
 class WikipediaScraper:
@@ -16,214 +119,328 @@ class WikipediaScraper:
         "Accept-Language": "en-US,en;q=0.5",
     }
     
+    # Retry policy for Wikipedia requests; a final error response still
+    # reaches raise_for_status(). Read timeouts aren't retried: each one
+    # already cost a full timeout, and scrape() falls back to the HTML page.
+    RETRY = Retry(
+        total=3,
+        read=False,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False
+    )
+    
+    # Appendix sections that are neither listed nor included in the content
+    _EXCLUDED_SECTIONS: FrozenSet[str] = frozenset({"See also", "References", "External links", "Notes", "Further reading", "Bibliography"})
+    
+    # Non-heading elements whose text goes into the content
+    _TEXT_TAGS: FrozenSet[str] = frozenset({"p", "h3", "li"})
+    
     def __init__(self):
         self.session = requests.Session()
         self.session.headers.update(self.HEADERS)
+        # Enough pooled keep-alive connections for concurrent scrapes; the
+        # session is safe to share between threads for GET requests.
+        # Transient rate limiting and server errors are retried with backoff.
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=self.RETRY)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
     
     def validate_url(self, url: str) -> bool:
         """Validate that the URL is a valid Wikipedia article URL."""
-        try:
-            parsed = urlparse(url)
-            if not parsed.netloc.endswith("wikipedia.org"):
-                return False
-            if "/wiki/" not in parsed.path:
-                return False
-            special_prefixes = ["Special:", "File:", "Category:", "Template:", "Talk:", "User:", "Wikipedia:", "Help:", "Portal:"]
-            article_name = parsed.path.split("/wiki/")[-1]
-            for prefix in special_prefixes:
-                if article_name.startswith(prefix):
-                    return False
-            return True
-        except Exception:
-            return False
+        return _WIKI_URL_RE.match(url) is not None
     
-    def fetch_article(self, url: str) -> Tuple[str, BeautifulSoup]:
-        """Fetch and parse a Wikipedia article."""
+    def fetch_article(self, url: str, include_raw_html: bool = False) -> Tuple[Optional[str], lxml.html.HtmlElement]:
+        """Fetch and parse a Wikipedia article, decoding the raw HTML only on request."""
         if not self.validate_url(url):
             raise ValueError(f"Invalid Wikipedia URL: {url}")
         
         response = self.session.get(url, timeout=30)
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.text, "html.parser")
-        return response.text, soup
+        # Raw bytes let the parser sniff the encoding itself
+        root = _parse_html(response.content)
+        return (response.text if include_raw_html else None), root
     
-    def extract_title(self, soup: BeautifulSoup) -> str:
-        """Extract the article title."""
-        title_elem = soup.find("h1", {"id": "firstHeading"})
-        if title_elem:
-            return title_elem.get_text(strip=True)
+    def fetch_article_api(self, url: str) -> Optional[Dict]:
+        """
+        Fetch the parsed article from the MediaWiki Action API.
         
-        title_tag = soup.find("title")
-        if title_tag:
-            title = title_tag.get_text(strip=True)
-            return title.replace(" - Wikipedia", "").strip()
+        One action=parse call returns the resolved title, the section list
+        and the article body HTML. Returns None if the API is unavailable
+        so the caller can fall back to scraping the page.
+        """
+        if not self.validate_url(url):
+            raise ValueError(f"Invalid Wikipedia URL: {url}")
         
-        return "Unknown Title"
-    
-    def extract_summary(self, soup: BeautifulSoup) -> str:
-        """Extract the article summary (first few paragraphs)."""
-        content_div = soup.find("div", {"id": "mw-content-text"})
-        if not content_div:
-            return ""
+        parts = urlsplit(url)
+        page = self._title_from_url(url)
+        try:
+            response = self.session.get(
+                f"{parts.scheme}://{parts.netloc}/w/api.php",
+                params={
+                    "action": "parse",
+                    "page": page,
+                    "prop": "text|sections",
+                    "redirects": 1,
+                    "disableeditsection": 1,
+                    "format": "json",
+                    "formatversion": 2,
+                },
+                timeout=30
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Action API request failed for {url}: {e}")
+            return None
         
-        parser_output = content_div.find("div", {"class": "mw-parser-output"})
-        if not parser_output:
-            return ""
+        if "parse" not in data:
+            logger.warning(f"Action API returned no parse for {url}: {data.get('error')}")
+            return None
+        return data["parse"]
+    
+    def _title_from_url(self, url: str) -> str:
+        """Article title encoded in the URL slug."""
+        path = urlsplit(url).path
+        return unquote(path.rsplit("/wiki/", 1)[-1]).replace("_", " ")
+    
+    def extract_title(self, root: lxml.html.HtmlElement, url: Optional[str] = None) -> str:
+        """Extract the article title, falling back to the URL slug."""
+        title_elem = root.find('.//h1[@id="firstHeading"]')
+        if title_elem is not None:
+            return _text(title_elem)
         
-        summary_parts = []
-        for elem in parser_output.find_all("p", limit=10):
-            if isinstance(elem, Tag):
-                text = elem.get_text(strip=True)
-                if text and len(text) > 50:
-                    summary_parts.append(text)
-                    if len(summary_parts) >= 2:
-                        break
-        
-        return " ".join(summary_parts)
+        if url:
+            return self._title_from_url(url)
+        return "Unknown Title"
     
-    def extract_sections(self, soup: BeautifulSoup) -> List[str]:
-        """Extract section headings from the article."""
-        sections = []
-        excluded = ["See also", "References", "External links", "Notes", "Further reading", "Bibliography"]
+    def extract_all(self, root: lxml.html.HtmlElement, stop_after_appendix: bool = False) -> Dict:
+        """
+        Extract the summary, sections, content and key entities of the article.
         
-        for heading in soup.find_all("h2"):
-            if isinstance(heading, Tag):
-                span = heading.find("span", {"class": "mw-headline"})
-                if span and isinstance(span, Tag):
-                    section_name = span.get_text(strip=True)
-                    if section_name not in excluded:
-                        sections.append(section_name)
+        All four come from a single walk over the article body instead of
+        separate queries per field. Callers that get the section list
+        elsewhere pass stop_after_appendix=True, which lets the walk stop once
+        nothing past the appendix can change the summary, content or
+        entities; the sections returned are then incomplete.
+        """
+        result = {
+            "summary": "",
+            "sections": [],
+            "content": "",
+            "key_entities": {"people": [], "organizations": [], "locations": []}
+        }
         
-        return sections
-    
-    def extract_content(self, soup: BeautifulSoup) -> str:
-        """Extract the main text content of the article."""
-        content_div = soup.find("div", {"id": "mw-content-text"})
-        if not content_div:
-            return ""
+        # API responses hold only the parser output, without the page wrapper
+        content_div = root.find('.//div[@id="mw-content-text"]')
+        if content_div is None:
+            content_div = root
         
-        parser_output = content_div.find("div", {"class": "mw-parser-output"})
-        if not parser_output:
-            return ""
+        parser_output = _find_by_class(content_div, "div", "mw-parser-output")
+        if parser_output is None:
+            return result
         
-        # Collect text without modifying the soup
-        text_parts = []
-        stop_sections = {"See also", "References", "External links", "Notes", "Further reading", "Bibliography"}
+        stop_sections = self._EXCLUDED_SECTIONS
+        text_tags = self._TEXT_TAGS
         stop_found = False
+        summary_parts = []
+        paragraphs_seen = 0
+        sections = []
+        text_parts = []
+        infobox_links = []
+        infobox_found = False
+        content_links = []
         
-        for elem in parser_output.find_all(["p", "h2", "h3", "li"]):
-            if not isinstance(elem, Tag):
+        for elem in parser_output.iterdescendants():
+            name = elem.tag
+            
+            if name == "a":
+                if len(content_links) < 100:
+                    content_links.append(elem)
                 continue
             
-            # Check if we've hit a stop section
-            if elem.name == "h2":
-                span = elem.find("span", {"class": "mw-headline"})
-                if span and isinstance(span, Tag):
-                    heading_text = span.get_text(strip=True)
+            if name == "table":
+                if not infobox_found and _INFOBOX_RE.search(elem.get("class", "")):
+                    infobox_found = True
+                    # Lazily take the first 50 anchors rather than collecting them all
+                    infobox_links = list(islice(elem.iter("a"), 50))
+                continue
+            
+            if name == "h2":
+                span = _find_by_class(elem, "span", "mw-headline")
+                if span is not None:
+                    heading_text = _text(span)
+                    # Content stops at the first appendix section
                     if heading_text in stop_sections:
                         stop_found = True
-                        break
+                    else:
+                        sections.append(heading_text)
+            elif name not in text_tags:
+                continue
+            
+            text = None
+            if name == "p":
+                # Summary: first two substantial paragraphs among the first ten
+                paragraphs_seen += 1
+                if paragraphs_seen <= 10 and len(summary_parts) < 2:
+                    text = _text(elem)
+                    if len(text) > 50:
+                        summary_parts.append(text)
             
-            # Skip if we're past stop sections
             if stop_found:
-                break
+                if (
+                    stop_after_appendix
+                    and infobox_found
+                    and len(content_links) >= 100
+                    and (len(summary_parts) >= 2 or paragraphs_seen >= 10)
+                ):
+                    break
+                continue
             
-            text = elem.get_text(strip=True)
+            if text is None:
+                text = _text(elem)
             if text and len(text) > 20:
                 text_parts.append(text)
         
-        return "\n\n".join(text_parts)
+        result["summary"] = " ".join(summary_parts)
+        result["sections"] = sections
+        result["content"] = "\n\n".join(text_parts)
+        result["key_entities"] = self._classify_entities(infobox_links, content_links)
+        return result
     
-    def extract_entities(self, soup: BeautifulSoup) -> Dict[str, List[str]]:
-        """Extract key entities from the article using simple heuristics."""
-        entities = {
-            "people": [],
-            "organizations": [],
-            "locations": []
+    def _classify_entities(self, infobox_links: List, content_links: List) -> Dict[str, List[str]]:
+        """Classify article links into key entities using simple heuristics."""
+        # Dicts double as insertion-ordered sets for O(1) dedup
+        entities: Dict[str, Dict[str, None]] = {
+            "people": {},
+            "organizations": {},
+            "locations": {}
         }
+        orgs = entities["organizations"]
+        locs = entities["locations"]
         
         try:
             # Extract from infobox
-            infobox = soup.find("table", {"class": re.compile(r"infobox")})
-            if infobox and isinstance(infobox, Tag):
-                links = list(infobox.find_all("a"))[:50]
-                for link in links:
-                    if not isinstance(link, Tag):
-                        continue
-                    href = link.get("href")
-                    if not href or not isinstance(href, str):
-                        continue
-                    text = link.get_text(strip=True)
-                    if not text or len(text) < 3:
-                        continue
-                    
-                    href_lower = href.lower()
-                    if any(kw in href_lower for kw in ["university", "institute", "company", "organization", "corporation"]):
-                        if text not in entities["organizations"] and len(entities["organizations"]) < 5:
-                            entities["organizations"].append(text)
-                    elif any(kw in href_lower for kw in ["country", "city", "state", "kingdom", "republic"]):
-                        if text not in entities["locations"] and len(entities["locations"]) < 5:
-                            entities["locations"].append(text)
+            for link in infobox_links:
+                if len(orgs) >= 5 and len(locs) >= 5:
+                    break
+                href = link.get("href")
+                if not href:
+                    continue
+                text = _text(link)
+                if not text or len(text) < 3:
+                    continue
+                
+                category = _match_category(_INFOBOX_AC, href.lower())
+                if category and len(entities[category]) < 5:
+                    entities[category][text] = None
             
             # Extract from content
-            content_soup = soup.find("div", {"class": "mw-parser-output"})
-            if content_soup and isinstance(content_soup, Tag):
-                links = list(content_soup.find_all("a"))[:100]
-                for link in links:
-                    if not isinstance(link, Tag):
-                        continue
-                    href = link.get("href")
-                    if not href or not isinstance(href, str):
-                        continue
-                    if not href.startswith("/wiki/"):
-                        continue
-                    
-                    text = link.get_text(strip=True)
-                    if not text or len(text) < 3:
-                        continue
-                    
-                    # Skip dates
-                    if re.match(r"^\d+$", text) or re.match(r"^\w+\s+\d+", text):
-                        continue
-                    
-                    href_lower = href.lower()
-                    if any(kw in href_lower for kw in ["_university", "_college", "_institute", "_company", "_corporation"]):
-                        if text not in entities["organizations"] and len(entities["organizations"]) < 5:
-                            entities["organizations"].append(text)
-                    elif any(kw in href_lower for kw in ["_country", "_city", "_state", "united_kingdom", "united_states"]):
-                        if text not in entities["locations"] and len(entities["locations"]) < 5:
-                            entities["locations"].append(text)
+            for link in content_links:
+                if len(orgs) >= 5 and len(locs) >= 5:
+                    break
+                href = link.get("href")
+                if not href:
+                    continue
+                if not href.startswith("/wiki/"):
+                    continue
+                
+                text = _text(link)
+                if not text or len(text) < 3:
+                    continue
+                
+                # Skip dates
+                if _DIGITS_RE.match(text) or _DATE_RE.match(text):
+                    continue
+                
+                category = _match_category(_CONTENT_AC, href.lower())
+                if category and len(entities[category]) < 5:
+                    entities[category][text] = None
         except Exception:
             pass
         
-        return entities
+        return {category: list(names) for category, names in entities.items()}
+    
+    def _api_sections(self, sections: List[Dict]) -> List[str]:
+        """Top-level section headings from an Action API section list."""
+        headings = []
+        for section in sections:
+            if str(section.get("level")) != "2":
+                continue
+            # Headings may carry inline markup such as <i>
+            heading = html.unescape(_TAG_RE.sub("", section["line"])).strip()
+            if heading and heading not in self._EXCLUDED_SECTIONS:
+                headings.append(heading)
+        return headings
     
-    def scrape(self, url: str) -> Dict:
+    def scrape(self, url: str, include_raw_html: bool = False) -> ScrapedArticle:
         """Scrape a Wikipedia article and return structured data."""
-        raw_html, soup = self.fetch_article(url)
-        
-        title = self.extract_title(soup)
-        summary = self.extract_summary(soup)
-        sections = self.extract_sections(soup)
-        entities = self.extract_entities(soup)
-        content = self.extract_content(soup)
-        
-        return {
-            "url": url,
-            "title": title,
-            "summary": summary,
-            "sections": sections,
-            "content": content,
-            "key_entities": entities,
-            "raw_html": raw_html
-        }
+        # The API body is only the article fragment, so raw HTML needs the page itself
+        parsed = None if include_raw_html else self.fetch_article_api(url)
+        
+        if parsed is None:
+            raw_html, root = self.fetch_article(url, include_raw_html)
+            title = self.extract_title(root, url)
+            extracted = self.extract_all(root)
+        else:
+            raw_html = None
+            title = parsed["title"]
+            extracted = self.extract_all(_parse_html(parsed["text"], fragment=True), stop_after_appendix=True)
+            extracted["sections"] = self._api_sections(parsed["sections"])
+        
+        # The full page is 1-2 MB; raw_html is only set for callers that ask
+        return ScrapedArticle(
+            url=url,
+            title=title,
+            summary=extracted["summary"],
+            sections=extracted["sections"],
+            content=extracted["content"],
+            key_entities=extracted["key_entities"],
+            raw_html=raw_html
+        )
 
 
 # Singleton instance
 scraper = WikipediaScraper()
 
+# Scrape results keyed by normalized URL, so retries and repeat requests
+# for the same article skip the fetch and parse
+SCRAPE_CACHE_SIZE = 512
+SCRAPE_CACHE_TTL = 3600
+_scrape_cache: "TTLCache[str, ScrapedArticle]" = TTLCache(maxsize=SCRAPE_CACHE_SIZE, ttl=SCRAPE_CACHE_TTL)
+_scrape_cache_lock = Lock()
+
+
+def scrape_wikipedia(url: str, include_raw_html: bool = False) -> ScrapedArticle:
+    """Convenience function to scrape a Wikipedia article, cached by URL."""
+    # Results with the full page HTML are too large to keep around
+    if include_raw_html:
+        return scraper.scrape(url, include_raw_html)
+    
+    key = normalize_url(url)
+    with _scrape_cache_lock:
+        cached = _scrape_cache.get(key)
+    if cached is None:
+        cached = scraper.scrape(url)
+        with _scrape_cache_lock:
+            _scrape_cache[key] = cached
+    # Hand out a copy so callers can't mutate the cached entry
+    return copy.deepcopy(cached)
+
+
+async def scrape_wikipedia_async(url: str, include_raw_html: bool = False) -> ScrapedArticle:
+    """Scrape a Wikipedia article in a worker thread without blocking the event loop."""
+    return await asyncio.to_thread(scrape_wikipedia, url, include_raw_html)
+
+
+def scrape_many(urls: List[str], max_workers: int = 8) -> List[ScrapedArticle]:
+    """Scrape several Wikipedia articles concurrently over the shared session, in input order."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(scrape_wikipedia, urls))
+
 
-def scrape_wikipedia(url: str) -> Dict:
-    """Convenience function to scrape a Wikipedia article."""
-    return scraper.scrape(url)
+async def scrape_many_async(urls: List[str]) -> List[ScrapedArticle]:
+    """Scrape several Wikipedia articles concurrently without blocking the event loop."""
+    return await asyncio.gather(*(scrape_wikipedia_async(url) for url in urls))
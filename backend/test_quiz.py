@@ -15,11 +15,11 @@ def test_quiz_generation():
     print("=== Step 1: Scraping Wikipedia ===")
     try:
         scraped_data = scrape_wikipedia(url)
-        print(f"Title: {scraped_data['title']}")
-        print(f"Summary length: {len(scraped_data['summary'])}")
-        print(f"Content length: {len(scraped_data['content'])}")
-        print(f"Sections: {scraped_data['sections'][:5]}")
-        print(f"Entities: {scraped_data['key_entities']}")
+        print(f"Title: {scraped_data.title}")
+        print(f"Summary length: {len(scraped_data.summary)}")
+        print(f"Content length: {len(scraped_data.content)}")
+        print(f"Sections: {scraped_data.sections[:5]}")
+        print(f"Entities: {scraped_data.key_entities}")
     except Exception as e:
         print(f"Scraping error: {e}")
         print("\n=== FULL TRACEBACK ===")
@@ -30,8 +30,8 @@ def test_quiz_generation():
     print("\n=== Step 2: Generating Quiz ===")
     try:
         quiz = generate_quiz(
-            title=scraped_data['title'],
-            content=scraped_data['content'],
+            title=scraped_data.title,
+            content=scraped_data.content,
             num_questions=5
         )
         print(f"Generated {len(quiz)} questions")
@@ -48,9 +48,9 @@ def test_quiz_generation():
     print("\n=== Step 3: Generating Related Topics ===")
     try:
         topics = generate_related_topics(
-            title=scraped_data['title'],
-            sections=scraped_data['sections'],
-            entities=scraped_data['key_entities']
+            title=scraped_data.title,
+            sections=scraped_data.sections,
+            entities=scraped_data.key_entities
         )
         print(f"Related topics: {topics}")
     except Exception as e: